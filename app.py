@@ -1,50 +1,187 @@
+import atexit
+import io
 import os
-import json
-from fastapi import FastAPI, Depends, HTTPException
+import sys
+import logging
+import logging.handlers
+import asyncio
+import queue
+import random
+import time
+import hashlib
+import hmac
+import uuid
+from collections import OrderedDict
+import numpy as np
+import orjson
+from fastapi import APIRouter, FastAPI, HTTPException, Header, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from typing import List, Optional, Union, Dict
-from openai import OpenAI
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from typing import List, Literal, Optional, Union, Dict
+from contextlib import asynccontextmanager
+from starlette.datastructures import Headers
+import aiohttp
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, NotFoundError, RateLimitError
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the raw record; message and traceback formatting happen on the listener thread"""
+    def prepare(self, record):
+        return record
+
+# Log records are written by a background thread so error bursts don't block the event loop on
+# stderr. The root logger's own handlers (from --log-config, basicConfig, ...) move behind the
+# queue, so the usual logging configuration still decides where records end up.
+root_logger = logging.getLogger()
+if not root_logger.handlers:
+    default_log_handler = logging.StreamHandler()
+    default_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root_logger.addHandler(default_log_handler)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+root_logger.handlers = [DeferredQueueHandler(log_queue)]
+# Started at import, so records are written before startup and under --lifespan off too
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open a keep-alive connection to OpenAI so the first evaluation skips DNS + TLS setup
+    try:
+        await client.models.list(timeout=5.0)
+    except Exception as e:
+        logger.warning("OpenAI connection warm-up failed: %s", e)
+    # Walk the routes now so the first /docs load doesn't block the loop doing it
+    build_openapi_bytes()
+    worker = asyncio.create_task(batch_worker()) if EVAL_BATCH_MAX > 1 else None
+    yield
+    if worker:
+        worker.cancel()
+    # Release pooled connections to OpenAI on shutdown
+    await client.close()
 
 # Initialize app with OpenAPI security scheme
 app = FastAPI(
     title="HART Evaluation API",
     description="Backend service for evaluating patient intake forms with AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    # Schema and docs are served below from a pre-serialized copy
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None
 )
 
-# Define Bearer security for Swagger Authorize button
-bearer_scheme = HTTPBearer()
+# Security: simple bearer token, checked in ASGI middleware so no dependency injection runs per request
+API_TOKEN = os.getenv("API_TOKEN", "hart-backend-secret-2025")
+API_TOKEN_BYTES = API_TOKEN.encode()
+PUBLIC_PATHS = frozenset({"/", "/health", "/openapi.json", "/docs", "/redoc"})
+FORBIDDEN_BODY = orjson.dumps({"detail": "Not authenticated"})
+FORBIDDEN_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(FORBIDDEN_BODY)).encode()),
+]
+
+def is_authorized(headers) -> bool:
+    for name, value in headers:
+        if name == b"authorization":
+            scheme, _, token = value.partition(b" ")
+            # Constant-time compare against the token encoded once at startup
+            return scheme.lower() == b"bearer" and hmac.compare_digest(token, API_TOKEN_BYTES)
+    return False
+
+class BearerAuthMiddleware:
+    def __init__(self, app):
+        self.app = app
 
-# CORS (so frontend can talk to backend)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PUBLIC_PATHS or is_authorized(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": 403, "headers": FORBIDDEN_HEADERS})
+        await send({"type": "http.response.body", "body": FORBIDDEN_BODY})
+
+# Added first so it sits inside CORS and rejections still carry CORS headers
+app.add_middleware(BearerAuthMiddleware)
+
+# CORS (so frontend can talk to backend); CORS_ORIGINS is a comma-separated list
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "https://hartintake.netlify.app").split(",")
+    if origin.strip()
+]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # restrict to frontend domain later
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type", "X-No-Batch"],
+    max_age=86400,  # let browsers reuse the preflight answer for a day
 )
 
-# Security: simple bearer token
-API_TOKEN = os.getenv("API_TOKEN", "hart-backend-secret-2025")
+class SSEAwareGZipMiddleware(GZipMiddleware):
+    """Gzip responses, except event streams, whose frames must not wait on the compressor"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "text/event-stream" in Headers(scope=scope).get("accept", ""):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Evaluations and reports are a few KB of plain text; level 5 gets most of the ratio for little CPU
+app.add_middleware(SSEAwareGZipMiddleware, minimum_size=512, compresslevel=5)
+
+# JSON request bodies are decoded with orjson; its JSONDecodeError subclasses the stdlib
+# one, so malformed bodies still get FastAPI's 422
+class ORJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+class ORJSONRoute(APIRoute):
+    def get_route_handler(self):
+        handler = super().get_route_handler()
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    if credentials.credentials != API_TOKEN:
-        raise HTTPException(status_code=403, detail="Not authenticated")
-    return True
+        async def orjson_route_handler(request: Request) -> Response:
+            return await handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+# Routes that require the bearer token (enforced by BearerAuthMiddleware)
+protected = APIRouter(route_class=ORJSONRoute)
 
 # Pydantic models
 class IntakeForm(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, str_strip_whitespace=True)
+
     name: str
     age: Union[int, str]  # accepts number or string
     gender: Optional[str] = None
-    symptoms: List[str]
+    symptoms: List[str] = Field(default_factory=list)
     history: Optional[str] = None
     medications: Optional[str] = None
     lifestyle: Optional[Dict[str, str]] = None  # smoking, alcohol
 
+    @field_validator("symptoms", mode="before")
+    @classmethod
+    def symptoms_default(cls, value):
+        return [] if value is None else value
+
 class EvaluationResult(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     chief_complaint: str
     history_summary: str
     risk_flags: Dict[str, str]
@@ -54,232 +191,1008 @@ class EvaluationResult(BaseModel):
     emergency_guidance: str
     formatted_report: str
 
+class AiohttpResponseStream(httpx.AsyncByteStream):
+    def __init__(self, response: aiohttp.ClientResponse):
+        self.response = response
+
+    async def __aiter__(self):
+        async for chunk in self.response.content.iter_any():
+            yield chunk
+
+    async def aclose(self):
+        self.response.release()
+
+class AiohttpTransport(httpx.AsyncBaseTransport):
+    """httpx transport that sends requests through one shared aiohttp session"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.session is None:
+            # Created lazily so it binds to the worker's running event loop
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                auto_decompress=False  # httpx decodes Content-Encoding itself
+            )
+        timeout = request.extensions.get("timeout", {})
+        try:
+            response = await self.session.request(
+                request.method,
+                str(request.url),
+                headers=request.headers.multi_items(),
+                data=await request.aread(),
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=timeout.get("connect"),
+                    sock_read=timeout.get("read")
+                )
+            )
+        except asyncio.TimeoutError as e:
+            raise httpx.ReadTimeout(str(e), request=request) from e
+        except aiohttp.ClientError as e:
+            raise httpx.ConnectError(str(e), request=request) from e
+        return httpx.Response(
+            response.status,
+            headers=list(response.raw_headers),
+            stream=AiohttpResponseStream(response),
+            request=request
+        )
+
+    async def aclose(self):
+        if self.session is not None:
+            await self.session.close()
+
 # OpenAI client
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_KEY:
     raise RuntimeError("OPENAI_API_KEY not set in environment")
-client = OpenAI(api_key=OPENAI_KEY)
+# Single client shared by all requests so TCP/TLS connections are kept alive.
+# HTTP/2 lets concurrent evaluations multiplex over one connection to api.openai.com;
+# OPENAI_HTTP_TRANSPORT=aiohttp swaps in aiohttp for very high fan-out.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+if os.getenv("OPENAI_HTTP_TRANSPORT", "httpx") == "aiohttp":
+    openai_transport = AiohttpTransport(limit=OPENAI_MAX_CONNECTIONS)
+else:
+    openai_transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2,
+            keepalive_expiry=60
+        )
+    )
+http_client = httpx.AsyncClient(
+    transport=openai_transport,
+    timeout=httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=5.0)
+)
+# SDK retries are off: create_completion's backoff loop is the only retry layer, and it
+# sleeps outside the concurrency semaphore
+client = AsyncOpenAI(api_key=OPENAI_KEY, http_client=http_client, max_retries=0)
 
-# Formatter for polished report
-def format_report(evaluation: dict, patient: IntakeForm) -> str:
-    """Format evaluation JSON into a polished report string"""
-    report = f"""
+class TokenBucket:
+    """Async token bucket that refills continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so capacity is handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+# Cap each worker's in-flight OpenAI calls so request bursts don't trigger 429 storms.
+# OPENAI_MAX_RPM / OPENAI_MAX_TPM are the account's rate limits; every worker process paces
+# itself to an equal share of them. The default matches the Procfile's worker count.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_MAX_ATTEMPTS = 5
+OPENAI_MAX_RPM = float(os.getenv("OPENAI_MAX_RPM", "0"))
+OPENAI_MAX_TPM = float(os.getenv("OPENAI_MAX_TPM", "0"))
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+request_bucket = TokenBucket(OPENAI_MAX_RPM / WEB_CONCURRENCY) if OPENAI_MAX_RPM > 0 else None
+token_bucket = TokenBucket(OPENAI_MAX_TPM / WEB_CONCURRENCY) if OPENAI_MAX_TPM > 0 else None
+
+def estimated_tokens(kwargs: dict) -> int:
+    # Roughly four characters per prompt token, plus the generation budget
+    prompt_chars = sum(len(message["content"]) for message in kwargs.get("messages", []))
+    return prompt_chars // 4 + kwargs.get("max_tokens", 0)
+
+@asynccontextmanager
+async def completion_slot(**kwargs):
+    """
+    Start a chat completion under the rate and concurrency caps, backing off on 429s, 5xx and
+    network errors. The concurrency slot is held until the block exits, so a streamed
+    completion counts against OPENAI_MAX_CONCURRENCY for as long as it is being read.
+    """
+    # One key per logical call, so OpenAI can deduplicate our retries
+    kwargs.setdefault("extra_headers", {"Idempotency-Key": uuid.uuid4().hex})
+    for attempt in range(OPENAI_MAX_ATTEMPTS):
+        if request_bucket:
+            await request_bucket.acquire()
+        if token_bucket:
+            await token_bucket.acquire(estimated_tokens(kwargs))
+        async with openai_semaphore:
+            try:
+                response = await client.chat.completions.create(**kwargs)
+            except (RateLimitError, InternalServerError, APIConnectionError):
+                if attempt == OPENAI_MAX_ATTEMPTS - 1:
+                    raise
+                response = None
+            if response is not None:
+                yield response
+                return
+        # Random exponential backoff, slept outside the semaphore
+        await asyncio.sleep(random.uniform(1, min(20, 2 ** (attempt + 1))))
+
+async def create_completion(**kwargs):
+    """Non-streaming completion; the concurrency slot is released once the reply has arrived"""
+    async with completion_slot(**kwargs) as response:
+        return response
+
+# Short-lived cache of evaluations keyed by intake content (EVAL_CACHE_TTL=0 disables it)
+EVAL_CACHE_TTL = float(os.getenv("EVAL_CACHE_TTL", "600"))
+EVAL_CACHE_SIZE = 4096
+eval_cache: OrderedDict = OrderedDict()
+
+def intake_cache_key(data: IntakeForm) -> str:
+    """Hash the canonical JSON form of an intake"""
+    canonical = orjson.dumps(data.model_dump(exclude_none=True), option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+def cache_get(key: str) -> Optional[dict]:
+    entry = eval_cache.get(key)
+    if entry is None:
+        return None
+    expires, evaluation = entry
+    if expires < time.monotonic():
+        del eval_cache[key]
+        return None
+    eval_cache.move_to_end(key)
+    return evaluation
+
+def cache_put(key: str, evaluation: dict):
+    # No awaits between lookup and insert, so no lock is needed on the event loop
+    eval_cache[key] = (time.monotonic() + EVAL_CACHE_TTL, evaluation)
+    eval_cache.move_to_end(key)
+    while len(eval_cache) > EVAL_CACHE_SIZE:
+        eval_cache.popitem(last=False)
+
+# Semantic cache: a near-duplicate intake reuses a cached evaluation when the cosine
+# similarity of their embeddings reaches EVAL_SEMANTIC_THRESHOLD (e.g. 0.95). Off by default;
+# entries live in the exact cache above, so it also requires EVAL_CACHE_TTL > 0.
+# A hit serves another patient's narrative (chief complaint, history summary, patient
+# summary), so while it is on the model is never sent names and hits need the same age and
+# gender. Free-text history is still summarized from the similar intake, not this one.
+EVAL_SEMANTIC_THRESHOLD = float(os.getenv("EVAL_SEMANTIC_THRESHOLD", "0"))
+EMBEDDING_MODEL = "text-embedding-3-small"
+semantic_keys: List[Optional[str]] = [None] * EVAL_CACHE_SIZE
+semantic_groups = np.zeros(EVAL_CACHE_SIZE, dtype=np.int64)  # demographics_group per row
+semantic_vectors: Optional[np.ndarray] = None  # ring buffer of unit vectors, one row per key
+semantic_count = 0
+
+async def embed_intake(data: IntakeForm) -> np.ndarray:
+    # The patient's name carries no clinical signal, so leave it out of the embedding
+    text = orjson.dumps(data.model_dump(exclude={"name"}, exclude_none=True), option=orjson.OPT_SORT_KEYS)
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text.decode())
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def demographics_group(data: IntakeForm) -> int:
+    """Hash of the age and gender a semantic hit must share"""
+    return hash((str(data.age).strip().lower(), (data.gender or "").strip().lower()))
+
+def semantic_get(vector: np.ndarray, data: IntakeForm) -> Optional[dict]:
+    if semantic_vectors is None:
+        return None
+    rows = min(semantic_count, EVAL_CACHE_SIZE)
+    scores = semantic_vectors[:rows] @ vector
+    scores[semantic_groups[:rows] != demographics_group(data)] = -1
+    best = int(np.argmax(scores))
+    if scores[best] < EVAL_SEMANTIC_THRESHOLD:
+        return None
+    # The exact-cache entry may have expired or been evicted since
+    return cache_get(semantic_keys[best])
+
+def semantic_put(key: str, vector: np.ndarray, data: IntakeForm):
+    global semantic_vectors, semantic_count
+    if semantic_vectors is None:
+        semantic_vectors = np.zeros((EVAL_CACHE_SIZE, vector.shape[0]), dtype=np.float32)
+    slot = semantic_count % EVAL_CACHE_SIZE
+    semantic_vectors[slot] = vector
+    semantic_keys[slot] = key
+    semantic_groups[slot] = demographics_group(data)
+    semantic_count += 1
+
+# Prompt pieces that never change between requests. The system message must stay
+# byte-identical across calls so OpenAI's prompt cache can reuse the prefix.
+OPENAI_MODEL = "gpt-4o-mini"
+
+# Structured outputs: OpenAI constrains the reply to exactly these keys. Strict mode
+# forbids open-ended objects, so risk flags travel as a list of name/value pairs.
+STRING = {"type": "string"}
+STRING_LIST = {"type": "array", "items": STRING}
+
+def strict_object(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+def json_schema_format(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+
+EVALUATION_PROPERTIES = {
+    "chief_complaint": STRING,
+    "history_summary": STRING,
+    "risk_flags": {"type": "array", "items": strict_object({"name": STRING, "value": STRING})},
+    "recommended_followups": STRING_LIST,
+    "differential_considerations": STRING_LIST,
+    "patient_friendly_summary": STRING,
+    "emergency_guidance": STRING,
+}
+
+RESPONSE_FORMAT = json_schema_format("evaluation", strict_object(EVALUATION_PROPERTIES))
+BATCH_RESPONSE_FORMAT = json_schema_format("evaluations", strict_object({
+    "evaluations": {
+        "type": "array",
+        "items": strict_object({"index": {"type": "integer"}, **EVALUATION_PROPERTIES}),
+    }
+}))
+
+EVALUATION_KEYS = (
+    "- chief_complaint (string)\n"
+    "- history_summary (string)\n"
+    "- risk_flags (list of {name, value} string pairs)\n"
+    "- recommended_followups (list of strings)\n"
+    "- differential_considerations (list of strings)\n"
+    "- patient_friendly_summary (string)\n"
+    "- emergency_guidance (string)"
+)
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a medical AI assistant. Analyze the patient intake provided by the user.\n\n"
+        "Provide a structured analysis in JSON with keys:\n" + EVALUATION_KEYS
+    ),
+}
+
+BATCH_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a medical AI assistant. The user provides several numbered patient intakes. "
+        "Analyze each intake independently.\n\n"
+        "Respond with a JSON object whose \"evaluations\" key is a list containing one object "
+        "per intake. Each object has an integer \"index\" matching the intake number and keys:\n"
+        + EVALUATION_KEYS
+    ),
+}
+
+INTAKE_TEMPLATE = (
+    "Name: %s\n"
+    "Age: %s\n"
+    "Gender: %s\n"
+    "Symptoms: %s\n"
+    "History: %s\n"
+    "Medications: %s\n"
+    "Lifestyle: %s"
+)
+
+def build_intake_prompt(data: IntakeForm) -> str:
+    return INTAKE_TEMPLATE % (
+        # Semantic hits are served to other patients, so the model must not see names
+        "Withheld" if EVAL_SEMANTIC_THRESHOLD > 0 else data.name,
+        data.age,
+        data.gender,
+        ", ".join(data.symptoms) or "None",
+        data.history,
+        data.medications,
+        orjson.dumps(data.lifestyle).decode() if data.lifestyle else None,
+    )
+
+# Intakes whose prompt would exceed this are refused before any OpenAI call
+MAX_INPUT_TOKENS = int(os.getenv("OPENAI_MAX_INPUT_TOKENS", "6000"))
+
+def check_intake_size(data: IntakeForm) -> None:
+    # Same four-characters-per-token estimate as the TPM bucket
+    if len(build_intake_prompt(data)) // 4 > MAX_INPUT_TOKENS:
+        raise HTTPException(status_code=413, detail="Intake is too long to evaluate")
+
+# Generation budget grows with the intake; the base covers the seven JSON keys
+MAX_COMPLETION_TOKENS = 1200
+MODEL_MAX_OUTPUT_TOKENS = 16384  # gpt-4o-mini's output cap, bounds micro-batch budgets
+
+class EvaluationTruncatedError(RuntimeError):
+    """The model hit max_tokens, leaving the JSON reply incomplete"""
+    def __init__(self):
+        super().__init__("Evaluation was cut off at the completion token limit")
+
+def completion_budget(data: IntakeForm) -> int:
+    return min(
+        MAX_COMPLETION_TOKENS,
+        400 + 40 * len(data.symptoms) + (200 if data.history else 0)
+    )
+
+def completion_params(data: IntakeForm) -> dict:
+    """Chat completion body for evaluating a single intake"""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [SYSTEM_MESSAGE, {"role": "user", "content": build_intake_prompt(data)}],
+        "response_format": RESPONSE_FORMAT,
+        "max_tokens": completion_budget(data),
+        # Deterministic output keeps identical intakes consistent and cacheable
+        "temperature": 0,
+        "seed": 1,
+    }
+
+async def request_evaluation(data: IntakeForm) -> dict:
+    """Ask OpenAI to evaluate a single intake and return the parsed JSON"""
+    params = completion_params(data)
+    response = await create_completion(**params)
+    if response.choices[0].finish_reason == "length" and params["max_tokens"] < MAX_COMPLETION_TOKENS:
+        # The sized budget was too small for this intake; retry once with the full one
+        params["max_tokens"] = MAX_COMPLETION_TOKENS
+        response = await create_completion(**params)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("OpenAI usage: %s", response.usage)
+
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise EvaluationTruncatedError()
+    return orjson.loads(choice.message.content)
+
+# Risk flag values rendered by exact type: one dict lookup per value, str() for anything else
+RISK_FLAG_FORMATTERS = {
+    str: lambda v: v,
+    bool: lambda v: "Yes" if v else "No",
+    list: lambda v: ", ".join(map(str, v)),
+    dict: lambda v: orjson.dumps(v).decode(),
+}
+
+def format_flag_value(value) -> str:
+    return RISK_FLAG_FORMATTERS.get(type(value), str)(value)
+
+def normalize_risk_flags(flags) -> Dict[str, str]:
+    """Accept the structured-output pair list or a plain mapping; values become strings"""
+    if not flags:
+        return {}
+    if isinstance(flags, list):
+        return {str(flag.get("name")): format_flag_value(flag.get("value")) for flag in flags}
+    return {k: format_flag_value(v) for k, v in flags.items()}
+
+def finalize_evaluation(evaluation: dict, data: IntakeForm) -> dict:
+    """Shape model output into the EvaluationResult fields and attach the formatted report"""
+    result = {
+        "chief_complaint": str(evaluation.get("chief_complaint", "N/A")),
+        "history_summary": str(evaluation.get("history_summary", "N/A")),
+        "risk_flags": normalize_risk_flags(evaluation.get("risk_flags")),
+        "recommended_followups": [str(item) for item in evaluation.get("recommended_followups") or []],
+        "differential_considerations": [str(item) for item in evaluation.get("differential_considerations") or []],
+        "patient_friendly_summary": str(evaluation.get("patient_friendly_summary", "N/A")),
+        "emergency_guidance": str(evaluation.get("emergency_guidance", "N/A")),
+    }
+
+    # Format report
+    result["formatted_report"] = format_report(result, data)
+    return result
+
+# Keep proxies (nginx, CDNs) from caching or buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(payload: dict) -> bytes:
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+async def stream_evaluation(data: IntakeForm, cache_key: Optional[str]):
+    """Relay completion deltas as server-sent events, then send the assembled evaluation"""
+    try:
+        async with completion_slot(**completion_params(data), stream=True) as stream:
+            try:
+                parts = []
+                finish_reason = None
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            finally:
+                # Also runs when the client disconnects mid-stream, releasing the connection
+                await stream.close()
+
+        if finish_reason == "length":
+            raise EvaluationTruncatedError()
+
+        evaluation = finalize_evaluation(orjson.loads("".join(parts)), data)
+        if cache_key:
+            cache_put(cache_key, evaluation)
+        yield sse_event({"evaluation": evaluation})
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        logger.exception("Streaming evaluation failed")
+        yield sse_event({"error": f"Internal error: {str(e)}"})
+
+# Micro-batching: intakes arriving within a short window share one completion call.
+# Disabled unless EVAL_BATCH_MAX > 1; callers can opt out per request with X-No-Batch: 1
+EVAL_BATCH_MAX = int(os.getenv("EVAL_BATCH_MAX", "1"))
+EVAL_BATCH_WINDOW = float(os.getenv("EVAL_BATCH_WINDOW_MS", "50")) / 1000
+batch_queue: asyncio.Queue = asyncio.Queue()
+batch_tasks: set = set()
+
+async def submit_to_batch(data: IntakeForm) -> dict:
+    future = asyncio.get_running_loop().create_future()
+    await batch_queue.put((data, future))
+    return await future
+
+async def batch_worker():
+    """Collect up to EVAL_BATCH_MAX queued intakes or wait EVAL_BATCH_WINDOW, then dispatch"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await batch_queue.get()]
+        deadline = loop.time() + EVAL_BATCH_WINDOW
+        while len(items) < EVAL_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(batch_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Dispatch without blocking collection of the next batch
+        task = asyncio.create_task(dispatch_batch(items))
+        batch_tasks.add(task)
+        task.add_done_callback(batch_tasks.discard)
+
+async def resolve_single(data: IntakeForm, future: asyncio.Future):
+    try:
+        future.set_result(await request_evaluation(data))
+    except Exception as e:
+        future.set_exception(e)
+
+async def dispatch_batch(items: list):
+    if len(items) == 1:
+        await resolve_single(*items[0])
+        return
+
+    user_content = "\n\n".join(
+        f"Intake {i}:\n{build_intake_prompt(data)}" for i, (data, _) in enumerate(items)
+    )
+    try:
+        response = await create_completion(
+            model=OPENAI_MODEL,
+            messages=[BATCH_SYSTEM_MESSAGE, {"role": "user", "content": user_content}],
+            response_format=BATCH_RESPONSE_FORMAT,
+            max_tokens=min(MODEL_MAX_OUTPUT_TOKENS, sum(completion_budget(data) for data, _ in items)),
+            temperature=0,
+            seed=1
+        )
+        choice = response.choices[0]
+        if choice.finish_reason == "length":
+            # The combined reply was cut off; every intake falls back to its own call below
+            by_index = {}
+        else:
+            results = orjson.loads(choice.message.content).get("evaluations", [])
+            by_index = {r.get("index"): r for r in results if isinstance(r, dict)}
+    except Exception as e:
+        for _, future in items:
+            future.set_exception(e)
+        return
+
+    retries = []
+    for i, (data, future) in enumerate(items):
+        evaluation = by_index.get(i)
+        if evaluation is None:
+            # The model dropped this intake; evaluate it on its own
+            retries.append(resolve_single(data, future))
+        else:
+            future.set_result(evaluation)
+    if retries:
+        await asyncio.gather(*retries)
+
+# Single-flight: identical intakes evaluated concurrently share one OpenAI call
+MAX_INFLIGHT = 1024
+inflight: Dict[str, asyncio.Task] = {}
+
+async def coalesced_evaluation(data: IntakeForm, key: str, batch: bool = True) -> dict:
+    """Model output for an intake, joining an identical evaluation already in progress"""
+    task = inflight.get(key)
+    if task is None:
+        call = submit_to_batch(data) if batch and EVAL_BATCH_MAX > 1 else request_evaluation(data)
+        if len(inflight) >= MAX_INFLIGHT:
+            return await call
+        task = asyncio.ensure_future(call)
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shielded so a caller going away doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+async def evaluate_cached(data: IntakeForm, use_cache: bool = True, batch: bool = True) -> dict:
+    """
+    Finalized evaluation for an intake: exact cache, then semantic cache, then one coalesced
+    OpenAI call. use_cache=False skips both lookups; the fresh result is still cached.
+    """
+    key = intake_cache_key(data)
+    cache_key = key if EVAL_CACHE_TTL > 0 else None
+    if cache_key and use_cache:
+        cached = cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+    vector = None
+    if cache_key and EVAL_SEMANTIC_THRESHOLD > 0 and use_cache:
+        try:
+            vector = await embed_intake(data)
+        except Exception as e:
+            logger.warning("Intake embedding failed: %s", e)
+        if vector is not None:
+            similar = semantic_get(vector, data)
+            if similar is not None:
+                # Rebuild the report so it carries this patient's details
+                evaluation = finalize_evaluation(similar, data)
+                cache_put(cache_key, evaluation)
+                return evaluation
+
+    evaluation = finalize_evaluation(await coalesced_evaluation(data, key, batch), data)
+    if cache_key:
+        cache_put(cache_key, evaluation)
+        if vector is not None:
+            semantic_put(cache_key, vector, data)
+    return evaluation
+
+# OpenAI Batch API: latency-tolerant intakes are submitted at half the interactive price.
+# Nothing about a batch is kept locally: any worker can answer a poll, even after a restart,
+# by rebuilding the results and the intakes the reports need from the batch's files on OpenAI.
+BATCH_API_SOURCE = "hart-evaluate"
+# Intakes accepted per /evaluate/batch call; the whole JSONL file is built in memory
+BATCH_API_MAX_INTAKES = int(os.getenv("BATCH_API_MAX_INTAKES", "1000"))
+# Completed results kept per worker, counted in intakes; larger batches are rebuilt on each poll
+BATCH_API_CACHE_ITEMS = int(os.getenv("BATCH_API_CACHE_ITEMS", "2000"))
+batch_api_results: OrderedDict = OrderedDict()  # batch id -> results of a completed batch
+batch_api_cached_items = 0
+BATCH_API_FAILED = ("failed", "expired", "cancelled")
+
+def batch_custom_id(i: int, data: IntakeForm) -> str:
+    # Carries the report header fields, so polled results never depend on the prompt wording
+    return orjson.dumps([i, data.name, data.age, data.gender]).decode()
+
+def intake_from_custom_id(custom_id: str) -> IntakeForm:
+    """Recover the fields the report header uses from a batch_custom_id"""
+    _, name, age, gender = orjson.loads(custom_id)
+    return IntakeForm(name=name, age=age, gender=gender)
+
+def batch_request_line(i: int, data: IntakeForm) -> dict:
+    return {
+        "custom_id": batch_custom_id(i, data),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": completion_params(data),
+    }
+
+async def submit_batch_file(lines: list) -> str:
+    """Upload request lines as JSONL and start a batch, returning its id"""
+    payload = b"\n".join(orjson.dumps(line) for line in lines)
+    batch_file = await client.files.create(file=("intakes.jsonl", payload), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"source": BATCH_API_SOURCE}
+    )
+    return batch.id
+
+async def submit_intakes(forms: List[IntakeForm]) -> str:
+    """Submit intakes as one batch, numbering them by position; failures become a 502"""
+    try:
+        return await submit_batch_file(
+            [batch_request_line(i, form) for i, form in enumerate(forms)]
+        )
+    except Exception as e:
+        logger.exception("Batch submission failed")
+        raise HTTPException(status_code=502, detail=f"Batch submission failed: {str(e)}")
+
+async def batch_file_lines(file_id: Optional[str]) -> list:
+    if not file_id:
+        return []
+    content = await client.files.content(file_id)
+    return [line for line in content.content.splitlines() if line.strip()]
+
+def batch_line_result(item: dict) -> tuple:
+    """(evaluation, error) for one line of a batch output or error file"""
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        return None, item.get("error") or response.get("body")
+    try:
+        choice = response["body"]["choices"][0]
+        if choice.get("finish_reason") == "length":
+            return None, str(EvaluationTruncatedError())
+        return orjson.loads(choice["message"]["content"]), None
+    except (LookupError, TypeError, ValueError) as e:
+        return None, f"Unreadable evaluation: {e}"
+
+async def batch_api_outputs(batch_id: str) -> tuple:
+    """
+    Return (status, results) for a batch this service submitted. results lists
+    (index, intake, evaluation, error) in submission order, and is None until the
+    batch completes. status is None when the batch is unknown.
+    """
+    if batch_id in batch_api_results:
+        batch_api_results.move_to_end(batch_id)
+        return "completed", batch_api_results[batch_id]
+
+    try:
+        batch = await client.batches.retrieve(batch_id)
+    except NotFoundError:
+        return None, None
+    if (batch.metadata or {}).get("source") != BATCH_API_SOURCE:
+        return None, None
+    if batch.status != "completed":
+        return batch.status, None
+
+    outcomes = {}
+    # A batch whose requests all failed has an error file and no output file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        for line in await batch_file_lines(file_id):
+            try:
+                item = orjson.loads(line)
+                outcomes[item["custom_id"]] = batch_line_result(item)
+            except (LookupError, TypeError, ValueError):
+                logger.warning("Skipping unreadable line in batch %s", batch_id)
+
+    results = []
+    for index, line in enumerate(await batch_file_lines(batch.input_file_id)):
+        custom_id = orjson.loads(line)["custom_id"]
+        evaluation, error = outcomes.get(custom_id, (None, "Missing from batch output"))
+        try:
+            intake = intake_from_custom_id(custom_id)
+        except (TypeError, ValueError):
+            # Submitted in another custom_id format; without a header there is no report
+            logger.warning("Batch %s request %d has no intake details", batch_id, index)
+            intake, evaluation, error = None, None, "Intake details unavailable"
+        results.append((index, intake, evaluation, error))
+
+    cache_batch_results(batch_id, results)
+    return "completed", results
+
+def cache_batch_results(batch_id: str, results: list):
+    global batch_api_cached_items
+    # Concurrent polls can both rebuild the same batch; it is only counted once
+    if len(results) > BATCH_API_CACHE_ITEMS or batch_id in batch_api_results:
+        return
+    batch_api_results[batch_id] = results
+    batch_api_cached_items += len(results)
+    while batch_api_cached_items > BATCH_API_CACHE_ITEMS:
+        _, evicted = batch_api_results.popitem(last=False)
+        batch_api_cached_items -= len(evicted)
+
+# Static report scaffolding, filled per evaluation with str.format
+REPORT_HEADER = """
     ======================================
               Patient Evaluation Report
     ======================================
 
-    Patient: {patient.name}
-    Age: {patient.age}
-    Gender: {patient.gender or "Not specified"}
+    Patient: {name}
+    Age: {age}
+    Gender: {gender}
 
     --------------------------------------
     Chief Complaint
     --------------------------------------
-    {evaluation.get('chief_complaint', 'N/A')}
+    {chief_complaint}
 
     --------------------------------------
     History Summary
     --------------------------------------
-    {evaluation.get('history_summary', 'N/A')}
+    {history_summary}
 
     --------------------------------------
     Risk Flags
     --------------------------------------
     """
-    for key, value in evaluation.get("risk_flags", {}).items():
-        report += f"- {key}: {value}\n"
-
-    # FIXED here: no backslashes in f-string braces
-    report += "\n\n--------------------------------------\nRecommended Follow-ups\n--------------------------------------\n"
-    report += "".join([f"- {item}\n" for item in evaluation.get("recommended_followups", [])])
 
-    report += "\n\n--------------------------------------\nDifferential Considerations\n--------------------------------------\n"
-    report += "".join([f"- {item}\n" for item in evaluation.get("differential_considerations", [])])
+REPORT_FOLLOWUPS_HEADING = "\n\n--------------------------------------\nRecommended Follow-ups\n--------------------------------------\n"
+REPORT_DIFFERENTIALS_HEADING = "\n\n--------------------------------------\nDifferential Considerations\n--------------------------------------\n"
 
-    report += f"""
+REPORT_FOOTER = """
 
     --------------------------------------
     Patient-Friendly Summary
     --------------------------------------
-    {evaluation.get('patient_friendly_summary', 'N/A')}
+    {patient_friendly_summary}
 
     --------------------------------------
     Emergency Guidance
     --------------------------------------
-    🚨 {evaluation.get('emergency_guidance', 'N/A')} 🚨
+    🚨 {emergency_guidance} 🚨
     """
 
-    return report.strip()
+# Formatter for polished report
+def format_report(evaluation: dict, patient: IntakeForm) -> str:
+    """Format evaluation JSON into a polished report string"""
+    parts = [REPORT_HEADER.format(
+        name=patient.name,
+        age=patient.age,
+        gender=patient.gender or "Not specified",
+        chief_complaint=evaluation.get("chief_complaint", "N/A"),
+        history_summary=evaluation.get("history_summary", "N/A"),
+    )]
+    parts.extend(f"- {key}: {value}\n" for key, value in evaluation.get("risk_flags", {}).items())
+
+    parts.append(REPORT_FOLLOWUPS_HEADING)
+    parts.extend(f"- {item}\n" for item in evaluation.get("recommended_followups", []))
+
+    parts.append(REPORT_DIFFERENTIALS_HEADING)
+    parts.extend(f"- {item}\n" for item in evaluation.get("differential_considerations", []))
+
+    parts.append(REPORT_FOOTER.format(
+        patient_friendly_summary=evaluation.get("patient_friendly_summary", "N/A"),
+        emergency_guidance=evaluation.get("emergency_guidance", "N/A"),
+    ))
 
+    return "".join(parts).strip()
 
-@app.post("/evaluate", response_model=EvaluationResult, dependencies=[Depends(verify_token)])
-async def evaluate_patient(data: IntakeForm):
+
+# Liveness probes are hit often by the load balancer; keep them allocation-light
+ROOT_BODY = orjson.dumps({"message": "HART Evaluation API is running"})
+
+@app.get("/")
+async def root():
+    return Response(content=ROOT_BODY, media_type="application/json")
+
+@app.get("/health")
+async def health():
+    body = orjson.dumps({"ok": True, "ts": int(time.time())})
+    return Response(content=body, media_type="application/json")
+
+# OpenAPI schema is built and serialized once, at startup (see lifespan)
+openapi_bytes: Optional[bytes] = None
+
+def build_openapi_bytes() -> bytes:
+    global openapi_bytes
+    if openapi_bytes is None:
+        schema = app.openapi()
+        # Auth lives in middleware, so mark the protected operations for Swagger's Authorize button here
+        schema["components"]["securitySchemes"] = {"HTTPBearer": {"type": "http", "scheme": "bearer"}}
+        for route in protected.routes:
+            for method in route.methods:
+                schema["paths"][route.path_format][method.lower()]["security"] = [{"HTTPBearer": []}]
+        openapi_bytes = orjson.dumps(schema)
+    return openapi_bytes
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json():
+    return Response(content=build_openapi_bytes(), media_type="application/json")
+
+@app.get("/docs", include_in_schema=False)
+async def swagger_ui():
+    return get_swagger_ui_html(openapi_url="/openapi.json", title=f"{app.title} - Swagger UI")
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc():
+    return get_redoc_html(openapi_url="/openapi.json", title=f"{app.title} - ReDoc")
+
+
+# Responses are shaped by finalize_evaluation and returned as ORJSONResponse directly,
+# skipping FastAPI's response_model validation; the model is kept for the OpenAPI docs
+@protected.post("/evaluate", responses={200: {"model": EvaluationResult}})
+async def evaluate_patient(
+    data: IntakeForm,
+    mode: Literal["sync", "batch"] = "sync",
+    no_cache: bool = False,
+    x_no_batch: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None)
+):
     """
-    Evaluate patient intake form using OpenAI GPT
+    Evaluate patient intake form using OpenAI GPT.
+    Send `Accept: text/event-stream` to receive the completion as server-sent events.
+    With `?mode=batch` the intake is queued for the OpenAI Batch API and a job id is
+    returned; poll `GET /evaluate/{job_id}` for the result.
+    `?no_cache=1` skips cached evaluations and always asks the model; the fresh result is still cached.
     """
+    check_intake_size(data)
+    if mode == "batch":
+        job_id = await submit_intakes([data])
+        return ORJSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
     try:
-        prompt = f"""
-        You are a medical AI assistant. Analyze the following intake:
-
-        Name: {data.name}
-        Age: {data.age}
-        Gender: {data.gender}
-        Symptoms: {", ".join(data.symptoms)}
-        History: {data.history}
-        Medications: {data.medications}
-        Lifestyle: {data.lifestyle}
-
-        Provide a structured analysis in JSON with keys:
-        - chief_complaint (string)
-        - history_summary (string)
-        - risk_flags (dictionary with string values only)
-        - recommended_followups (list of strings)
-        - differential_considerations (list of strings)
-        - patient_friendly_summary (string)
-        - emergency_guidance (string)
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
+        if accept is not None and "text/event-stream" in accept:
+            cache_key = intake_cache_key(data) if EVAL_CACHE_TTL > 0 else None
+            cached = cache_get(cache_key) if cache_key and not no_cache else None
+            if cached is not None:
+                events = iter([sse_event({"evaluation": cached})])
+            else:
+                events = stream_evaluation(data, cache_key)
+            return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
 
-        ai_content = response.choices[0].message.content
-        evaluation = json.loads(ai_content)
+        evaluation = await evaluate_cached(data, use_cache=not no_cache, batch=x_no_batch != "1")
+        return ORJSONResponse(evaluation)
 
-        # Ensure risk_flags are strings
-        evaluation["risk_flags"] = {
-            k: str(v) for k, v in evaluation.get("risk_flags", {}).items()
-        }
+    except Exception as e:
+        logger.exception("Evaluation failed")
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
-        # Format report
-        evaluation["formatted_report"] = format_report(evaluation, data)
+@protected.get("/evaluate/{job_id}", responses={200: {"model": EvaluationResult}})
+async def get_batch_evaluation(job_id: str):
+    """
+    Fetch the result of an intake submitted with `?mode=batch`
+    """
+    try:
+        status, results = await batch_api_outputs(job_id)
+    except Exception as e:
+        logger.exception("Batch retrieval failed")
+        raise HTTPException(status_code=502, detail=f"Batch retrieval failed: {str(e)}")
 
-        return evaluation
+    # A job is a batch holding a single intake
+    if status is None or (results is not None and len(results) != 1):
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if results is None:
+        if status in BATCH_API_FAILED:
+            raise HTTPException(status_code=502, detail=f"Batch {status}")
+        return ORJSONResponse({"job_id": job_id, "status": status}, status_code=202)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    _, intake, evaluation, error = results[0]
+    if error is not None:
+        raise HTTPException(status_code=502, detail=error)
+    return ORJSONResponse(finalize_evaluation(evaluation, intake))
 
-from fastapi.responses import FileResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-import tempfile
+# PDF styles are built once at import; the sample stylesheet is rebuilt on every call otherwise
+PDF_STYLES = getSampleStyleSheet()
+PDF_TITLE = PDF_STYLES["Title"]
+PDF_HEADING = PDF_STYLES["Heading2"]
+PDF_BODY = PDF_STYLES["Normal"]
+PDF_SPACER = Spacer(1, 12)  # holds no layout state, so one instance serves every document
 
-@app.post("/export-pdf", dependencies=[Depends(verify_token)])
-async def export_pdf(data: EvaluationResult):
+def pdf_section(title: str, lines: List[str]) -> list:
+    return [
+        Paragraph(f"<b>{title}</b>", PDF_HEADING),
+        *(Paragraph(line, PDF_BODY) for line in lines),
+        PDF_SPACER,
+    ]
+
+@protected.post("/evaluate/batch", status_code=202)
+async def evaluate_batch(forms: List[IntakeForm]):
     """
-    Export the evaluation result as a formatted PDF.
+    Submit many intakes at once through the OpenAI Batch API.
+    Poll `GET /evaluate/batch/{batch_id}` for the results.
+    """
+    if not forms:
+        raise HTTPException(status_code=400, detail="No intakes provided")
+    if len(forms) > BATCH_API_MAX_INTAKES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_API_MAX_INTAKES} intakes per batch")
+    for form in forms:
+        check_intake_size(form)
+    batch_id = await submit_intakes(forms)
+    return {"batch_id": batch_id, "status": "submitted", "count": len(forms)}
+
+@protected.get("/evaluate/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """
+    Status of a batch submitted to `/evaluate/batch`, with one result per intake once complete
     """
     try:
-        # Create a temporary file for PDF
-        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        doc = SimpleDocTemplate(tmp_file.name, pagesize=letter)
-        styles = getSampleStyleSheet()
-        flowables = []
+        status, results = await batch_api_outputs(batch_id)
+    except Exception as e:
+        logger.exception("Batch retrieval failed")
+        raise HTTPException(status_code=502, detail=f"Batch retrieval failed: {str(e)}")
 
-        # Title
-        flowables.append(Paragraph("❤️ HART Patient Evaluation Report", styles["Title"]))
-        flowables.append(Spacer(1, 12))
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown batch")
+    if results is None:
+        if status in BATCH_API_FAILED:
+            raise HTTPException(status_code=502, detail=f"Batch {status}")
+        return ORJSONResponse({"batch_id": batch_id, "status": status}, status_code=202)
 
-        # Sections
-        flowables.append(Paragraph("<b>Chief Complaint</b>", styles["Heading2"]))
-        flowables.append(Paragraph(data.chief_complaint, styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+    items = []
+    for index, intake, evaluation, error in results:
+        if error is None:
+            items.append({"index": index, "evaluation": finalize_evaluation(evaluation, intake)})
+        else:
+            items.append({"index": index, "error": error})
+    return ORJSONResponse({"batch_id": batch_id, "status": status, "results": items})
 
-        flowables.append(Paragraph("<b>History Summary</b>", styles["Heading2"]))
-        flowables.append(Paragraph(data.history_summary, styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+# Intakes accepted per /evaluate/many call; larger lists belong on /evaluate/batch
+EVAL_MANY_MAX = int(os.getenv("EVAL_MANY_MAX", "20"))
 
-        flowables.append(Paragraph("<b>Risk Flags</b>", styles["Heading2"]))
-        for k, v in data.risk_flags.items():
-            flowables.append(Paragraph(f"- {k}: {v}", styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+@protected.post("/evaluate/many")
+async def evaluate_many(forms: List[IntakeForm]):
+    """
+    Evaluate several intakes right away, in parallel.
+    Results keep the request order; a failed intake gets an `error` instead of an `evaluation`.
+    """
+    if not forms:
+        raise HTTPException(status_code=400, detail="No intakes provided")
+    if len(forms) > EVAL_MANY_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {EVAL_MANY_MAX} intakes per request; use /evaluate/batch for more")
+    for form in forms:
+        check_intake_size(form)
 
-        flowables.append(Paragraph("<b>Recommended Follow-ups</b>", styles["Heading2"]))
-        for item in data.recommended_followups:
-            flowables.append(Paragraph(f"- {item}", styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+    outcomes = await asyncio.gather(*(evaluate_cached(form) for form in forms), return_exceptions=True)
+    items = []
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            logger.error("Evaluation %d of %d failed: %s", i, len(forms), outcome)
+            items.append({"index": i, "error": str(outcome)})
+        else:
+            items.append({"index": i, "evaluation": outcome})
+    return ORJSONResponse({"results": items})
 
-        flowables.append(Paragraph("<b>Differential Considerations</b>", styles["Heading2"]))
-        for item in data.differential_considerations:
-            flowables.append(Paragraph(f"- {item}", styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+# The body is parsed and validated in one pass by pydantic-core; the schema is declared
+# here so the docs still show it
+@protected.post(
+    "/export-pdf",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/EvaluationResult"}}}
+    }}
+)
+async def export_pdf(request: Request):
+    """
+    Export the evaluation result as a formatted PDF.
+    """
+    try:
+        data = EvaluationResult.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
 
-        flowables.append(Paragraph("<b>Patient-Friendly Summary</b>", styles["Heading2"]))
-        flowables.append(Paragraph(data.patient_friendly_summary, styles["Normal"]))
-        flowables.append(Spacer(1, 12))
+    try:
+        # Render in memory; nothing touches the disk
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter)
+        flowables = [Paragraph("❤️ HART Patient Evaluation Report", PDF_TITLE), PDF_SPACER]
 
-        flowables.append(Paragraph("<b>Emergency Guidance</b>", styles["Heading2"]))
-        flowables.append(Paragraph(f"🚨 {data.emergency_guidance} 🚨", styles["Normal"]))
+        # Sections
+        flowables.extend(pdf_section("Chief Complaint", [data.chief_complaint]))
+        flowables.extend(pdf_section("History Summary", [data.history_summary]))
+        flowables.extend(pdf_section("Risk Flags", [f"- {k}: {v}" for k, v in data.risk_flags.items()]))
+        flowables.extend(pdf_section("Recommended Follow-ups", [f"- {item}" for item in data.recommended_followups]))
+        flowables.extend(pdf_section("Differential Considerations", [f"- {item}" for item in data.differential_considerations]))
+        flowables.extend(pdf_section("Patient-Friendly Summary", [data.patient_friendly_summary]))
+        flowables.extend(pdf_section("Emergency Guidance", [f"🚨 {data.emergency_guidance} 🚨"]))
 
         # Build PDF
         doc.build(flowables)
 
-        return FileResponse(tmp_file.name, media_type="application/pdf", filename="HART_Report.pdf")
+        return Response(
+            content=buffer.getvalue(),
+            media_type="application/pdf",
+            headers={"Content-Disposition": 'attachment; filename="HART_Report.pdf"'}
+        )
 
     except Exception as e:
+        logger.exception("PDF export failed")
         raise HTTPException(status_code=500, detail=f"PDF export failed: {str(e)}")
 
-from fastapi.responses import FileResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-import tempfile
+app.include_router(protected)
 
-@app.post("/export-pdf")
-async def export_pdf(evaluation: EvaluationResult):
-    """
-    Export AI evaluation into a polished PDF
-    """
-    try:
-        # Create temporary PDF file
-        tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-        c = canvas.Canvas(tmpfile.name, pagesize=letter)
-        width, height = letter
-
-        # Header
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(200, height - 50, "HART - Patient Evaluation Report")
-
-        # Body
-        y = height - 100
-        c.setFont("Helvetica", 12)
-
-        def add_line(label, text):
-            nonlocal y
-            if y < 100:  # start new page
-                c.showPage()
-                y = height - 50
-                c.setFont("Helvetica", 12)
-            c.drawString(50, y, f"{label}: {text}")
-            y -= 20
-
-        add_line("Chief Complaint", evaluation.chief_complaint)
-        add_line("History Summary", evaluation.history_summary)
-
-        c.drawString(50, y, "Risk Flags:")
-        y -= 20
-        for k, v in evaluation.risk_flags.items():
-            add_line(f"- {k}", v)
-
-        c.drawString(50, y, "Recommended Follow-ups:")
-        y -= 20
-        for item in evaluation.recommended_followups:
-            add_line("-", item)
-
-        c.drawString(50, y, "Differential Considerations:")
-        y -= 20
-        for item in evaluation.differential_considerations:
-            add_line("-", item)
-
-        add_line("Patient-Friendly Summary", evaluation.patient_friendly_summary)
-        add_line("Emergency Guidance", evaluation.emergency_guidance)
-
-        # Save PDF
-        c.save()
-
-        return FileResponse(tmpfile.name, filename="Patient_Report.pdf")
+if __name__ == "__main__":
+    import uvicorn
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
+    # Same settings as the Procfile; size WEB_CONCURRENCY at roughly 2 x cores + 1.
+    # Workers are spawned processes, so each one builds its own OpenAI client and pool.
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5000")),
+        workers=WEB_CONCURRENCY,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop has no Windows build
+        http="httptools",
+        backlog=2048,
+        access_log=False,
+    )